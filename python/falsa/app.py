@@ -1,8 +1,10 @@
-import random
 import shutil
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable, NamedTuple, Optional, Tuple, Union
 
+import numpy as np
 import pyarrow as pa
 import typer
 from pyarrow import csv, parquet
@@ -48,12 +50,14 @@ class Size(str, Enum):
 
     def _to(self) -> H2ODatasetSizes:
         # Workaround. Typer does not support IntEnum
-        if self is Size.SMALL:
-            return H2ODatasetSizes.SMALL
-        elif self is Size.MEDIUM:
-            return H2ODatasetSizes.MEDIUM
-        else:
-            return H2ODatasetSizes.BIG
+        return _SIZE_MAP[self]
+
+
+_SIZE_MAP = {
+    Size.SMALL: H2ODatasetSizes.SMALL,
+    Size.MEDIUM: H2ODatasetSizes.MEDIUM,
+    Size.BIG: H2ODatasetSizes.BIG,
+}
 
 
 class Format(str, Enum):
@@ -69,15 +73,18 @@ class Format(str, Enum):
 
 
 # An amount of rows per dataset is n // divisor
-_DIVISORS = {
-    "groupby": 1,
-    "join_big": 1,
-    "join_big_na": 1,
-    "join_small": 1_000_000,
-    "join_medium": 1_000,
-}
+class _Divisors(NamedTuple):
+    groupby: int = 1
+    join_big: int = 1
+    join_big_na: int = 1
+    join_small: int = 1_000_000
+    join_medium: int = 1_000
+
 
+_DIVISORS = _Divisors()
 
+
+@lru_cache(maxsize=None)
 def _pretty_sci(n: int) -> str:
     # See https://github.com/duckdblabs/db-benchmark/blob/main/_data/groupby-datagen.R#L5
     # pretty_sci = function(x) {
@@ -91,39 +98,35 @@ def _pretty_sci(n: int) -> str:
     if n == 0:
         return "NA"
 
-    # format in scientific notation and remove +
-    formatted_num = f"{n:.0e}".replace("+", "")
-    e_value = int(formatted_num.split("e")[1])
-
-    if e_value >= 10:
-        return formatted_num
-
-    elif e_value == 0:
-        return formatted_num.replace("00", "0")
-
-    elif e_value < 10:
-        return formatted_num.replace("0", "")
-
-    else:
-        raise ValueError("Unexpected value following e")
+    # One significant digit in scientific notation, rounded half to even as "{:.0e}" does
+    e = len(str(n)) - 1
+    lead, rest = divmod(n, 10**e)
+    if 2 * rest > 10**e or (2 * rest == 10**e and lead % 2 == 1):
+        lead += 1
+    if lead == 10:
+        lead, e = 1, e + 1
+    return f"{lead}e{e}"
+
+
+_OUTPUT_NAMES = {
+    "groupby": "G1_{n}_{n}_{k}_{nas}{fmt}",
+    "join_big": "J1_{n}_{n}_NA{fmt}",
+    "join_big_na": "J1_{n}_{n}_{nas}{fmt}",
+    "join_small": "J1_{n}_{n_divided}_{nas}{fmt}",
+    "join_medium": "J1_{n}_{n_divided}_{nas}{fmt}",
+}
 
 
 def _create_filename(ds_type: str, n: int, k: int, nas: int, fmt: Format) -> str:
     if fmt is Format.DELTA:
         suffix = ""
     else:
-        suffix = "." + fmt.lower()
-    output_names = {
-        "groupby": "G1_{n}_{n}_{k}_{nas}{fmt}",
-        "join_big": "J1_{n}_{n}_NA{fmt}",
-        "join_big_na": "J1_{n}_{n}_{nas}{fmt}",
-        "join_small": "J1_{n}_{n_divided}_{nas}{fmt}",
-        "join_medium": "J1_{n}_{n_divided}_{nas}{fmt}",
-    }
+        suffix = "." + fmt.value.lower()
 
-    n_divisor = _DIVISORS[ds_type]
+    n_divisor = getattr(_DIVISORS, ds_type)
     n_divided = n // n_divisor
-    return output_names[ds_type].format(n=_pretty_sci(n), n_divided=_pretty_sci(n_divided), k=k, nas=nas, fmt=suffix)
+    fields = {"n": _pretty_sci(n), "n_divided": _pretty_sci(n_divided), "k": k, "nas": nas, "fmt": suffix}
+    return _OUTPUT_NAMES[ds_type].format_map(fields)
 
 
 def _clear_prev_if_exists(fp: Path, fmt: Format) -> None:
@@ -135,6 +138,149 @@ def _clear_prev_if_exists(fp: Path, fmt: Format) -> None:
             shutil.rmtree(fp, ignore_errors=True)
 
 
+# Parquet row groups hold a fixed amount of rows, about this size (in memory) each,
+# so the parquet layout does not depend on the batch size used for generation.
+_PARQUET_ROW_GROUP_BYTES = 128 * 1024 * 1024
+# The amount of rows in a row group is rounded down to a multiple of this one
+_PARQUET_ROW_GROUP_ROWS_STEP = 64 * 1024
+
+
+class _ParquetRowGroupWriter:
+    """A wrapper on top of ParquetWriter that writes row groups of the same amount of rows, ~128Mb each.
+
+    The amount of rows is derived from the bytes per row of the first batch;
+    rows that do not fill a row group are kept until the next batches or the end of the file.
+    """
+
+    def __init__(
+        self,
+        where: Path,
+        schema: pa.Schema,
+        compression: str = "snappy",
+        data_page_version: str = "1.0",
+        write_batch_size: Optional[int] = None,
+    ) -> None:
+        # Defaults are the ones of pyarrow; column statistics are always written
+        self._writer = parquet.ParquetWriter(
+            where=where,
+            schema=schema,
+            compression=compression,
+            data_page_version=data_page_version,
+            write_batch_size=write_batch_size,
+        )
+        self._schema = schema
+        self._row_group_rows = 0
+        self._buffer = []
+        self._buffered_rows = 0
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        if batch.num_rows == 0:
+            return
+        if not self._row_group_rows:
+            rows = _PARQUET_ROW_GROUP_BYTES * batch.num_rows // max(batch.nbytes, 1)
+            step = _PARQUET_ROW_GROUP_ROWS_STEP
+            self._row_group_rows = max(step, rows // step * step)
+        self._buffer.append(batch)
+        self._buffered_rows += batch.num_rows
+        if self._buffered_rows >= self._row_group_rows:
+            self._flush(self._buffered_rows // self._row_group_rows * self._row_group_rows)
+
+    def _flush(self, num_rows: int) -> None:
+        table = pa.Table.from_batches(self._buffer, schema=self._schema)
+        # Without an explicit row_group_size pyarrow splits the table into 1Mi rows groups
+        self._writer.write_table(table.slice(0, num_rows), row_group_size=self._row_group_rows)
+        self._buffer = table.slice(num_rows).to_batches()
+        self._buffered_rows -= num_rows
+
+    def close(self) -> None:
+        try:
+            if self._buffered_rows:
+                self._flush(self._buffered_rows)
+        finally:
+            self._writer.close()
+
+
+# CSV output goes through a buffered stream, so the file gets a few big writes instead of one per chunk of rows.
+_CSV_BUFFER_BYTES = 4 * 1024 * 1024
+
+
+class _CSVWriter:
+    """A wrapper on top of CSVWriter that owns a buffered output stream."""
+
+    def __init__(self, where: Path, schema: pa.Schema, batch_rows: int) -> None:
+        self._raw = pa.OSFile(str(where), "wb")
+        self._sink = pa.BufferedOutputStream(self._raw, buffer_size=_CSV_BUFFER_BYTES)
+        # Even the largest batch is converted in one go, so the conversion buffer is sized once
+        self._writer = csv.CSVWriter(
+            self._sink, schema, write_options=csv.WriteOptions(include_header=True, batch_size=batch_rows)
+        )
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self._writer.write_batch(batch)
+
+    def close(self) -> None:
+        try:
+            self._writer.close()
+        finally:
+            try:
+                self._sink.close()
+            finally:
+                self._raw.close()
+
+
+def _make_writer(
+    data_format: Format,
+    output_path: Path,
+    schema: pa.Schema,
+    max_batch_rows: int,
+    compression: str = "snappy",
+    data_page_version: str = "1.0",
+    write_batch_size: Optional[int] = None,
+) -> Tuple[Union[_CSVWriter, _ParquetRowGroupWriter], Callable[[], None]]:
+    """Create a writer for the given format and a finalizer to run after the writer is closed.
+
+    compression, data_page_version and write_batch_size are passed to the parquet writer of PARQUET and DELTA.
+    """
+    if data_format is Format.CSV:
+        return _CSVWriter(where=output_path, schema=schema, batch_rows=max_batch_rows), lambda: None
+
+    parquet_options = {
+        "compression": compression,
+        "data_page_version": data_page_version,
+        "write_batch_size": write_batch_size,
+    }
+    if data_format is Format.PARQUET:
+        return _ParquetRowGroupWriter(where=output_path, schema=schema, **parquet_options), lambda: None
+
+    # Delta is a directory with a parquet file and a delta-log on top of it
+    output_path.mkdir(parents=True)
+    writer = _ParquetRowGroupWriter(where=output_path.joinpath("data.parquet"), schema=schema, **parquet_options)
+    return writer, lambda: generate_delta_log(output_path, schema)
+
+
+def _write_dataset(
+    generator: Union[GroupByGenerator, JoinSmallGenerator, JoinMediumGenerator, JoinBigGenerator],
+    output_path: Path,
+    data_format: Format,
+    progress: bool = False,
+) -> None:
+    # An empty plan has no largest batch, but the CSV conversion batch should still be positive
+    max_batch_rows = int(generator.batches.max(initial=1))
+    writer, finalize = _make_writer(data_format, output_path, generator.schema, max_batch_rows)
+    # Generators run ahead of the writer in their own threads
+    batches = generator.as_reader()
+    if progress:
+        batches = track(batches, total=len(generator.batches))
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+    finally:
+        writer.close()
+
+    # The delta-log is written only on top of the complete data
+    finalize()
+
+
 @app.command(help="Create H2O GroupBy Dataset")
 def groupby(
     path_prefix: Annotated[str, typer.Option(help="An output folder for generated data")],
@@ -148,59 +294,25 @@ def groupby(
         typer.Option(help="An output format for generated data."),
     ] = Format.CSV,
 ):
-    gb = GroupByGenerator(size._to(), k, nas, seed, batch_size)
-    data_filename = _create_filename("groupby", size._to().value, k, nas, data_format)
+    n = size._to()
+    n_val = n.value
+    gb = GroupByGenerator(n, k, nas, seed, batch_size)
+    data_filename = _create_filename("groupby", n_val, k, nas, data_format)
     output_dir = Path(path_prefix)
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
     output_filepath = output_dir.joinpath(data_filename)
     _clear_prev_if_exists(output_filepath, data_format)
 
-    print(f"{size._to().value} rows will be saved into: [green]{output_filepath.absolute().__str__()}[/green]\n")
-
-    schema = pa.schema(
-        [
-            ("id1", pa.utf8()),
-            ("id2", pa.utf8()),
-            ("id3", pa.utf8()),
-            ("id4", pa.int64()),
-            ("id5", pa.int64()),
-            ("id6", pa.int64()),
-            ("v1", pa.int64(), False),
-            ("v2", pa.int64(), False),
-            ("v3", pa.float64(), False),
-        ]
-    )
+    print(f"{n_val} rows will be saved into: [green]{output_filepath.absolute().__str__()}[/green]\n")
 
     print("An output data [green]schema[/green] is the following:")
-    print(schema)
+    print(gb.schema)
     print()
 
     data_format.pprint()
     print()
-    if data_format is Format.CSV:
-        writer = csv.CSVWriter(sink=output_filepath, schema=schema)
-        for batch in track(gb.iter_batches(), total=len(gb.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.PARQUET:
-        writer = parquet.ParquetWriter(where=output_filepath, schema=schema)
-        for batch in track(gb.iter_batches(), total=len(gb.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.DELTA:
-        output_filepath.mkdir(parents=True)
-        delta_file_pq = output_filepath.joinpath("data.parquet")
-        writer = parquet.ParquetWriter(where=delta_file_pq, schema=schema)
-        for batch in track(gb.iter_batches(), total=len(gb.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-        generate_delta_log(output_filepath, schema)
+    _write_dataset(gb, output_filepath, data_format, progress=True)
 
 
 @app.command(help="Create three H2O join datasets")
@@ -216,19 +328,21 @@ def join(
         typer.Option(help="An output format for generated data."),
     ] = Format.CSV,
 ):
-    random.seed(seed)
-    keys_seed = random.randint(0, NATIVE_I64_MAX_VALUE)
-    generation_seed = random.randint(0, NATIVE_I64_MAX_VALUE)
-    n_small = size._to() // _DIVISORS["join_small"]
-    n_medium = size._to() // _DIVISORS["join_medium"]
-    n_big = size._to() // _DIVISORS["join_big"]
-    join_small = JoinSmallGenerator(size._to(), n_small, k, generation_seed, keys_seed, min([batch_size, n_small]))
-    join_medium = JoinMediumGenerator(size._to(), n_medium, k, generation_seed, keys_seed, min([batch_size, n_medium]))
-    join_big = JoinBigGenerator(size._to(), n_big, k, nas, generation_seed, keys_seed, min([batch_size, n_big]))
-
-    data_filename_small = _create_filename("join_small", size._to().value, k, nas, data_format)
-    data_filename_medium = _create_filename("join_medium", size._to().value, k, nas, data_format)
-    data_filename_big = _create_filename("join_big", size._to().value, k, nas, data_format)
+    n = size._to()
+    n_val = n.value
+    # Both seeds are drawn from one generator, the global state of random is not touched
+    rng = np.random.default_rng(seed)
+    keys_seed, generation_seed = rng.integers(0, NATIVE_I64_MAX_VALUE, size=2, dtype=np.int64).tolist()
+    n_small = n_val // _DIVISORS.join_small
+    n_medium = n_val // _DIVISORS.join_medium
+    n_big = n_val // _DIVISORS.join_big
+    join_small = JoinSmallGenerator(n, n_small, k, generation_seed, keys_seed, min([batch_size, n_small]))
+    join_medium = JoinMediumGenerator(n, n_medium, k, generation_seed, keys_seed, min([batch_size, n_medium]))
+    join_big = JoinBigGenerator(n, n_big, k, nas, generation_seed, keys_seed, min([batch_size, n_big]))
+
+    data_filename_small = _create_filename("join_small", n_val, k, nas, data_format)
+    data_filename_medium = _create_filename("join_medium", n_val, k, nas, data_format)
+    data_filename_big = _create_filename("join_big", n_val, k, nas, data_format)
 
     output_dir = Path(path_prefix)
     if not output_dir.exists():
@@ -241,131 +355,23 @@ def join(
     _clear_prev_if_exists(output_medium, data_format)
     _clear_prev_if_exists(output_big, data_format)
 
-    print(
-        f"{size._to().value // _DIVISORS['join_small']} rows will be saved into: [green]{output_small.absolute().__str__()}[/green]\n"
-    )
-    print(
-        f"{size._to().value // _DIVISORS['join_medium']} rows will be saved into: [green]{output_medium.absolute().__str__()}[/green]\n"
-    )
-    print(
-        f"{size._to().value // _DIVISORS['join_big']} rows will be saved into: [green]{output_big.absolute().__str__()}[/green]\n"
-    )
-
-    schema_small = pa.schema(
-        [
-            ("id1", pa.int64(), False),
-            ("id4", pa.utf8(), False),
-            ("v2", pa.float64(), False),
-        ]
-    )
-    schema_medium = pa.schema(
-        [
-            ("id1", pa.int64(), False),
-            ("id2", pa.int64(), False),
-            ("id4", pa.utf8(), False),
-            ("id5", pa.utf8(), False),
-            ("v2", pa.float64(), False),
-        ]
-    )
-    schema_big = pa.schema(
-        [
-            ("id1", pa.int64()),
-            ("id2", pa.int64()),
-            ("id3", pa.int64()),
-            ("id4", pa.utf8(), False),
-            ("id5", pa.utf8(), False),
-            ("id6", pa.utf8(), False),
-            ("v2", pa.float64()),
-        ]
-    )
-    data_format.pprint()
-    print()
-
-    print("An [bold]SMALL[/bold] data [green]schema[/green] is the following:")
-    print(schema_small)
-    print()
-
-    if data_format is Format.CSV:
-        writer = csv.CSVWriter(sink=output_small, schema=schema_small)
-        for batch in track(join_small.iter_batches(), total=len(join_small.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.PARQUET:
-        writer = parquet.ParquetWriter(where=output_small, schema=schema_small)
-        for batch in track(join_small.iter_batches(), total=len(join_small.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.DELTA:
-        output_small.mkdir(parents=True)
-        delta_file_pq = output_small.joinpath("data.parquet")
-        writer = parquet.ParquetWriter(where=delta_file_pq, schema=schema_small)
-        for batch in track(join_small.iter_batches(), total=len(join_small.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-        generate_delta_log(output_small, schema_small)
-
-    print()
-    print("An [bold]MEDIUM[/bold] data [green]schema[/green] is the following:")
-    print(schema_medium)
-    print()
-
-    if data_format is Format.CSV:
-        writer = csv.CSVWriter(sink=output_medium, schema=schema_medium)
-        for batch in track(join_medium.iter_batches(), total=len(join_medium.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.PARQUET:
-        writer = parquet.ParquetWriter(where=output_medium, schema=schema_medium)
-        for batch in track(join_medium.iter_batches(), total=len(join_medium.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.DELTA:
-        output_medium.mkdir(parents=True)
-        delta_file_pq = output_medium.joinpath("data.parquet")
-        writer = parquet.ParquetWriter(where=delta_file_pq, schema=schema_medium)
-        for batch in track(join_medium.iter_batches(), total=len(join_medium.batches)):
-            writer.write_batch(batch)
+    print(f"{n_small} rows will be saved into: [green]{output_small.absolute().__str__()}[/green]\n")
+    print(f"{n_medium} rows will be saved into: [green]{output_medium.absolute().__str__()}[/green]\n")
+    print(f"{n_big} rows will be saved into: [green]{output_big.absolute().__str__()}[/green]\n")
 
-        writer.close()
-        generate_delta_log(output_medium, schema_medium)
-
-    print()
-    print("An [bold]BIG[/bold] data [green]schema[/green] is the following:")
-    print(schema_big)
+    data_format.pprint()
     print()
 
-    if data_format is Format.CSV:
-        writer = csv.CSVWriter(sink=output_big, schema=schema_big)
-        for batch in track(join_big.iter_batches(), total=len(join_big.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.PARQUET:
-        writer = parquet.ParquetWriter(where=output_big, schema=schema_big)
-        for batch in track(join_big.iter_batches(), total=len(join_big.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-
-    if data_format is Format.DELTA:
-        output_big.mkdir(parents=True)
-        delta_file_pq = output_big.joinpath("data.parquet")
-        writer = parquet.ParquetWriter(where=delta_file_pq, schema=schema_big)
-        for batch in track(join_big.iter_batches(), total=len(join_big.batches)):
-            writer.write_batch(batch)
-
-        writer.close()
-        generate_delta_log(output_big, schema_big)
+    for name, generator, output_path in (
+        ("SMALL", join_small, output_small),
+        ("MEDIUM", join_medium, output_medium),
+        ("BIG", join_big, output_big),
+    ):
+        print(f"An [bold]{name}[/bold] data [green]schema[/green] is the following:")
+        print(generator.schema)
+        print()
+        _write_dataset(generator, output_path, data_format, progress=True)
+        print()
 
 
 def entry_point() -> None:
@@ -1,19 +1,73 @@
-import random
-from typing import Iterator
-
+import operator
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
 import pyarrow as pa
 
 from falsa import H2ODatasetSizes
 
 from .native import (
     generate_groupby,
+    generate_groupby_batches,
     generate_join_dataset_big,
     generate_join_dataset_medium,
     generate_join_dataset_small,
+    generate_join_keys_big,
+    generate_join_keys_medium,
+    generate_join_keys_small,
 )
 
 NATIVE_I64_MAX_VALUE = 9_223_372_036_854_775_806
 
+# Schemas of the batches returned by the native generators
+_GROUPBY_SCHEMA = pa.schema(
+    [
+        ("id1", pa.utf8()),
+        ("id2", pa.utf8()),
+        ("id3", pa.utf8()),
+        ("id4", pa.int64()),
+        ("id5", pa.int64()),
+        ("id6", pa.int64()),
+        ("v1", pa.int64(), False),
+        ("v2", pa.int64(), False),
+        ("v3", pa.float64(), False),
+    ]
+)
+_JOIN_SMALL_SCHEMA = pa.schema(
+    [
+        ("id1", pa.int64(), False),
+        ("id4", pa.utf8(), False),
+        ("v2", pa.float64(), False),
+    ]
+)
+_JOIN_MEDIUM_SCHEMA = pa.schema(
+    [
+        ("id1", pa.int64(), False),
+        ("id2", pa.int64(), False),
+        ("id4", pa.utf8(), False),
+        ("id5", pa.utf8(), False),
+        ("v2", pa.float64(), False),
+    ]
+)
+_JOIN_BIG_SCHEMA = pa.schema(
+    [
+        ("id1", pa.int64()),
+        ("id2", pa.int64()),
+        ("id3", pa.int64()),
+        ("id4", pa.utf8(), False),
+        ("id5", pa.utf8(), False),
+        ("id6", pa.utf8(), False),
+        ("v2", pa.float64()),
+    ]
+)
+
 
 def _validate_int64(num: int, prefix: str) -> None:
     # We are passing values from Python as i64 and converted to u64/usize inside;
@@ -24,143 +78,321 @@ def _validate_int64(num: int, prefix: str) -> None:
         raise ValueError(f"Values are passed to native as int64; MAX={NATIVE_I64_MAX_VALUE} but got {prefix}={num}")
 
 
-class GroupByGenerator:
+def _validate_params(
+    size: int, k: int, batch_size: int, nas: Optional[int] = None
+) -> tuple[int, int, int, Optional[int]]:
+    # operator.index accepts only true integers (IntEnum sizes too) and returns them as plain ints
+    size, k, batch_size = operator.index(size), operator.index(k), operator.index(batch_size)
+    _validate_int64(size, "size")
+    if nas is not None:
+        nas = operator.index(nas)
+        if (nas < 0) or (nas > 100):
+            raise ValueError(f"nas should be in [0, 100], but got {nas}")
+    if (k < 1) or (k > size):
+        raise ValueError(f"k should be positive and less than {size} but got {k}")
+    if (batch_size <= 0) or (batch_size > size):
+        raise ValueError(f"batch size should be positive and less than {size} but got {batch_size}")
+    return size, k, batch_size, nas
+
+
+def _batch_sizes(n_rows: int, batch_size: int) -> np.ndarray:
+    num_batches, remainder = divmod(n_rows, batch_size)
+    sizes = np.full(num_batches + (1 if remainder else 0), batch_size, dtype=np.int64)
+    # A corner case when we need to add one more batch
+    if remainder:
+        sizes[-1] = remainder
+    return sizes
+
+
+def _batch_seeds(seed: int, num_batches: int) -> np.ndarray:
+    # Generate a random seed per batch. 32 bits are enough to seed a batch, but the seeds are drawn
+    # without replacement: with a few thousands of batches a repeated seed (the same batch twice) is likely otherwise.
+    rng = np.random.default_rng(seed)
+    return rng.choice(np.iinfo(np.uint32).max + 1, size=num_batches, replace=False).astype(np.uint32)
+
+
+# Generated batches that may wait for the consumer, on top of the ones being generated
+_DEFAULT_PREFETCH = 2
+# Used when the size of the physical memory is not known
+_FALLBACK_MEMORY_BUDGET = 4 * 1024 * 1024 * 1024
+
+
+def _cpu_count() -> int:
+    # Cores this process may run on, which is less than os.cpu_count() under taskset / cgroup cpusets
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _memory_budget() -> int:
+    # A half of the physical memory; sysconf and its names are not available on all the platforms
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (AttributeError, ValueError, OSError):
+        return _FALLBACK_MEMORY_BUDGET
+
+
+def _validate_parallelism(parallelism: Optional[int], prefetch: Optional[int]) -> tuple[int, int]:
+    if parallelism is None:
+        parallelism = _cpu_count()
+    if parallelism <= 0:
+        raise ValueError(f"parallelism should be positive but got {parallelism}")
+    if prefetch is None:
+        prefetch = _DEFAULT_PREFETCH
+    if prefetch < 0:
+        raise ValueError(f"prefetch should be non negative but got {prefetch}")
+    return parallelism, prefetch
+
+
+def _generate_in_order(
+    generate: Callable[..., pa.RecordBatch],
+    args: Iterable[tuple],
+    parallelism: int,
+    prefetch: int,
+    max_bytes: Optional[int] = None,
+) -> Iterator[pa.RecordBatch]:
+    """Run generate(*a) for each a of args in a pool of threads and yield the batches in the order of args.
+
+    Native generators release the GIL, so up to parallelism batches are generated on several cores at once
+    and up to prefetch more of them wait to be consumed.
+    All the batches alive at once, the consumed one included, are kept within max_bytes (a half of the physical
+    memory by default): the first batch is generated alone and its size tells how many of them fit.
+    At least one batch is generated ahead of the consumer anyway.
+    """
+    if max_bytes is None:
+        max_bytes = _memory_budget()
+    args = iter(args)
+    with ThreadPoolExecutor(max_workers=parallelism) as pool:
+        pending = deque(pool.submit(generate, *a) for a in islice(args, 1))
+        window = 0
+        try:
+            while pending:
+                batch = pending.popleft().result()
+                if not window:
+                    # The consumed batch is alive too, so it is not a part of the window
+                    window = max(1, min(parallelism + prefetch, max_bytes // max(batch.nbytes, 1) - 1))
+                for a in islice(args, window - len(pending)):
+                    pending.append(pool.submit(generate, *a))
+                yield batch
+        finally:
+            # Do not generate batches nobody is waiting for anymore
+            for future in pending:
+                future.cancel()
+
+
+def _read_ahead(batches: Iterable[pa.RecordBatch], prefetch: int) -> Iterator[pa.RecordBatch]:
+    """Iterate over batches in a background thread and yield them in the same order.
+
+    The next batch is produced while the current one is consumed, up to prefetch of them wait in a queue.
+    """
+    ready = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+    end = object()
+
+    def put(item: object) -> None:
+        # Wait for a free slot unless nobody consumes the batches anymore
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce() -> None:
+        try:
+            for batch in batches:
+                if stop.is_set():
+                    return
+                put(batch)
+        finally:
+            put(end)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        producer = pool.submit(produce)
+        try:
+            while True:
+                item = ready.get()
+                if item is end:
+                    break
+                yield item
+        finally:
+            stop.set()
+        # Errors of the iteration are raised to the consumer
+        producer.result()
+
+
+class _BatchGenerator(ABC):
+    """A common part of all the generators: a plan of batches and the ways to read them."""
+
+    __slots__ = ("batch_sizes", "batch_seeds", "parallelism", "prefetch")
+
+    _schema: pa.Schema
+
+    def _plan_batches(
+        self, n_rows: int, batch_size: int, seed: int, parallelism: Optional[int], prefetch: Optional[int]
+    ) -> None:
+        self.parallelism, self.prefetch = _validate_parallelism(parallelism, prefetch)
+
+        self.batch_sizes = _batch_sizes(n_rows, batch_size)
+
+        self.batch_seeds = _batch_seeds(seed, len(self.batch_sizes))
+
+    def _iter_plan(self) -> Iterator[tuple[int, int]]:
+        """Pairs of (seed, size), one per batch."""
+        return zip(self.batch_seeds.tolist(), self.batch_sizes.tolist())
+
+    @property
+    def batches(self) -> np.ndarray:
+        """Sizes of all the batches, one per batch."""
+        return self.batch_sizes
+
+    @property
+    def schema(self) -> pa.Schema:
+        """Schema of all the batches."""
+        return self._schema
+
+    @abstractmethod
+    def iter_batches(self) -> Iterator[pa.RecordBatch]:
+        """All the batches, in the order of the plan."""
+
+    def as_reader(self) -> pa.RecordBatchReader:
+        """All the batches as a stream, for consumers that take a RecordBatchReader."""
+        return pa.RecordBatchReader.from_batches(self.schema, self.iter_batches())
+
+
+class GroupByGenerator(_BatchGenerator):
     """A simple wrapper on top of native generator.
 
     The class takes care of random seeds generation, input validation
     and calculation of the size of all batches.
     """
 
+    __slots__ = ("n", "k", "nas")
+
+    _schema = _GROUPBY_SCHEMA
+
     def __init__(
-            self, size: H2ODatasetSizes | int, k: int, nas: int = 0, seed: int = 42, batch_size: int = 5_000_000
+            self, size: H2ODatasetSizes | int, k: int, nas: int = 0, seed: int = 42, batch_size: int = 5_000_000,
+            parallelism: Optional[int] = None,
+            prefetch: Optional[int] = None,
     ) -> None:
-        _validate_int64(size, "size")
-        if (nas < 0) or (nas > 100):
-            raise ValueError(f"nas should be in [0, 100], but got {nas}")
-        if (k < 0) or (k > size):
-            raise ValueError(f"k should be positive and less than {size} but got {k}")
-        if (batch_size <= 0) or (batch_size > size):
-            raise ValueError(f"batch size should be positive and less than {size} but got {batch_size}")
+        size, k, batch_size, nas = _validate_params(size, k, batch_size, nas)
         self.n: int = size
         self.k = k
         self.nas = nas
 
-        num_batches = self.n // batch_size
-        batches = [batch_size for _ in range(num_batches)]
-        # A corner case when we need to add one more batch
-        if self.n % batch_size != 0:
-            batches.append(self.n % batch_size)
-
-        # Generate a random seed per batch
-        random.seed(seed)
-        self.batches = [{"size": bs, "seed": random.randint(0, NATIVE_I64_MAX_VALUE)} for bs in batches]
+        self._plan_batches(self.n, batch_size, seed, parallelism, prefetch)
 
     def iter_batches(self) -> Iterator[pa.RecordBatch]:
-        for batch in self.batches:
-            yield generate_groupby(self.n, self.k, self.nas, batch["seed"], batch["size"])
-
-
-class JoinSmallGenerator:
+        if self.parallelism == 1:
+            # The serial path: all the batches come from one native stream, without a round trip to Python per batch;
+            # the stream is read ahead by a background thread, so the next batch is generated while this one is consumed
+            reader = generate_groupby_batches(
+                self.n, self.k, self.nas, pa.array(self.batch_seeds, type=pa.int64()), pa.array(self.batch_sizes)
+            )
+            yield from _read_ahead(reader, self.prefetch)
+            return
+        args = ((self.n, self.k, self.nas, batch_seed, batch_size) for batch_seed, batch_size in self._iter_plan())
+        yield from _generate_in_order(generate_groupby, args, self.parallelism, self.prefetch)
+
+
+class JoinSmallGenerator(_BatchGenerator):
     """A simple wrapper on top of native generator.
 
     The class takes care of random seeds generation, input validation
     and calculation of the size of all batches.
     """
 
+    __slots__ = ("n", "n_rows", "k", "keys_seed", "keys")
+
+    _schema = _JOIN_SMALL_SCHEMA
+
     def __init__(
-            self, size: H2ODatasetSizes | int, n_rows: int, k: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000
+            self, size: H2ODatasetSizes | int, n_rows: int, k: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000,
+            parallelism: Optional[int] = None,
+            prefetch: Optional[int] = None,
     ) -> None:
-        _validate_int64(size, "size")
-        if (k < 0) or (k > size):
-            raise ValueError(f"k should be positive and less than {size} but got {k}")
-        if (batch_size <= 0) or (batch_size > size):
-            raise ValueError(f"batch size should be positive and less than {size} but got {batch_size}")
+        size, k, batch_size, _ = _validate_params(size, k, batch_size)
         self.n: int = size
         self.n_rows = n_rows
         self.k = k
         self.keys_seed = keys_seed
+        # Join-keys are the same for all the batches; they are generated once on the first iteration
+        self.keys = None
 
-        num_batches = self.n_rows // batch_size
-        batches = [batch_size for _ in range(num_batches)]
-        # A corner case when we need to add one more batch
-        if self.n_rows % batch_size != 0:
-            batches.append(self.n_rows % batch_size)
-
-        # Generate a random seed per batch
-        random.seed(seed)
-        self.batches = [{"size": bs, "seed": random.randint(0, NATIVE_I64_MAX_VALUE)} for bs in batches]
+        self._plan_batches(self.n_rows, batch_size, seed, parallelism, prefetch)
 
     def iter_batches(self) -> Iterator[pa.RecordBatch]:
-        for batch in self.batches:
-            yield generate_join_dataset_small(self.n, batch["seed"], self.keys_seed, batch["size"])
+        if self.keys is None:
+            self.keys = generate_join_keys_small(self.n, self.keys_seed)
+        args = ((self.n, self.keys, batch_seed, batch_size) for batch_seed, batch_size in self._iter_plan())
+        yield from _generate_in_order(generate_join_dataset_small, args, self.parallelism, self.prefetch)
 
 
-class JoinMediumGenerator:
+class JoinMediumGenerator(_BatchGenerator):
     """A simple wrapper on top of native generator.
 
     The class takes care of random seeds generation, input validation
     and calculation of the size of all batches.
     """
 
+    __slots__ = ("n", "n_rows", "k", "keys_seed", "keys")
+
+    _schema = _JOIN_MEDIUM_SCHEMA
+
     def __init__(
-            self, size: H2ODatasetSizes | int, n_rows: int, k: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000
+            self, size: H2ODatasetSizes | int, n_rows: int, k: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000,
+            parallelism: Optional[int] = None,
+            prefetch: Optional[int] = None,
     ) -> None:
-        _validate_int64(size, "size")
-        if (k < 0) or (k > size):
-            raise ValueError(f"k should be positive and less than {size} but got {k}")
-        if (batch_size <= 0) or (batch_size > size):
-            raise ValueError(f"batch size should be positive and less than {size} but got {batch_size}")
+        size, k, batch_size, _ = _validate_params(size, k, batch_size)
         self.n: int = size
         self.n_rows = n_rows
         self.k = k
         self.keys_seed = keys_seed
+        # Join-keys are the same for all the batches; they are generated once on the first iteration
+        self.keys = None
 
-        num_batches = self.n_rows // batch_size
-        batches = [batch_size for _ in range(num_batches)]
-        # a corner case when we need to add one more batch
-        if self.n_rows % batch_size != 0:
-            batches.append(self.n_rows % batch_size)
-
-        # Generate a random seed per batch
-        random.seed(seed)
-        self.batches = [{"size": bs, "seed": random.randint(0, NATIVE_I64_MAX_VALUE)} for bs in batches]
+        self._plan_batches(self.n_rows, batch_size, seed, parallelism, prefetch)
 
     def iter_batches(self) -> Iterator[pa.RecordBatch]:
-        for batch in self.batches:
-            yield generate_join_dataset_medium(self.n, batch["seed"], self.keys_seed, batch["size"])
+        if self.keys is None:
+            self.keys = generate_join_keys_medium(self.n, self.keys_seed)
+        k1, k2 = self.keys
+        args = ((self.n, k1, k2, batch_seed, batch_size) for batch_seed, batch_size in self._iter_plan())
+        yield from _generate_in_order(generate_join_dataset_medium, args, self.parallelism, self.prefetch)
 
 
-class JoinBigGenerator:
+class JoinBigGenerator(_BatchGenerator):
     """A simple wrapper on top of native generator.
 
     The class takes care of random seeds generation, input validation
     and calculation of the size of all batches.
     """
 
+    __slots__ = ("n", "n_rows", "nas", "k", "keys_seed", "keys")
+
+    _schema = _JOIN_BIG_SCHEMA
+
     def __init__(
-            self, size: H2ODatasetSizes | int, n_rows: int, k: int, nas: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000
+            self, size: H2ODatasetSizes | int, n_rows: int, k: int, nas: int, seed: int = 42, keys_seed: int = 142, batch_size: int = 5_000_000,
+            parallelism: Optional[int] = None,
+            prefetch: Optional[int] = None,
     ) -> None:
-        _validate_int64(size, "size")
-        if (k < 0) or (k > size):
-            raise ValueError(f"k should be positive and less than {size} but got {k}")
-        if (batch_size <= 0) or (batch_size > size):
-            raise ValueError(f"batch size should be positive and less than {size} but got {batch_size}")
+        size, k, batch_size, nas = _validate_params(size, k, batch_size, nas)
         self.n: int = size
         self.n_rows = n_rows
         self.nas = nas
         self.k = k
         self.keys_seed = keys_seed
+        # Join-keys are the same for all the batches; they are generated once on the first iteration
+        self.keys = None
 
-        num_batches = self.n // batch_size
-        batches = [batch_size for _ in range(num_batches)]
-        # A corner case when we need to add one more batch
-        if self.n % batch_size != 0:
-            batches.append(self.n % batch_size)
-
-        # Generate a random seed per batch
-        random.seed(seed)
-        self.batches = [{"size": bs, "seed": random.randint(0, NATIVE_I64_MAX_VALUE)} for bs in batches]
+        self._plan_batches(self.n, batch_size, seed, parallelism, prefetch)
 
     def iter_batches(self) -> Iterator[pa.RecordBatch]:
-        for batch in self.batches:
-            yield generate_join_dataset_big(self.n, self.nas, batch["seed"], self.keys_seed, batch["size"])
+        if self.keys is None:
+            self.keys = generate_join_keys_big(self.n, self.keys_seed)
+        k1, k2, k3 = self.keys
+        args = ((self.n, self.nas, k1, k2, k3, batch_seed, batch_size) for batch_seed, batch_size in self._iter_plan())
+        yield from _generate_in_order(generate_join_dataset_big, args, self.parallelism, self.prefetch)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import json
+import os
 import time
+from functools import lru_cache
 from pathlib import Path
 from uuid import uuid4
 
@@ -12,6 +14,26 @@ PA_2_DELTA_DTYPES = {
     "int64": "long",
 }
 
+_DELTA_LOG_BUFFER_BYTES = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _delta_schema_string(schema: Schema) -> str:
+    # Output schemas are module constants, so the fields are walked once per schema, not once per dataset
+    fields = []
+    for field in schema:
+        pa_type = str(field.type)
+        fields.append(
+            {
+                "name": field.name,
+                "type": PA_2_DELTA_DTYPES.get(pa_type, pa_type),
+                "nullable": field.nullable,
+                "metadata": {},
+            }
+        )
+    # Delta keeps the schema as a JSON document inside a string field, so it is encoded twice by design
+    return json.dumps({"type": "struct", "fields": fields})
+
 
 def generate_delta_log(output_filepath: Path, schema: Schema) -> None:
     """Generate a delta-log from existing parquet files and the given schema."""
@@ -20,32 +42,21 @@ def generate_delta_log(output_filepath: Path, schema: Schema) -> None:
     delta_dir.mkdir(exist_ok=True)
     add_meta_log = "0" * file_len + ".json"
 
-    with open(delta_dir.joinpath(add_meta_log), "w") as meta_log:
-        jsons = []
+    schema_string = _delta_schema_string(schema)
+
+    # Actions are written one by one into the buffered file instead of joining them into a single string first
+    with open(delta_dir.joinpath(add_meta_log), "w", buffering=_DELTA_LOG_BUFFER_BYTES) as meta_log:
         # Generate "metaData"
-        jsons.append(
+        meta_log.write(
             json.dumps(
                 {
                     "metaData": {
-                        "id": uuid4().__str__(),
+                        "id": str(uuid4()),
                         "format": {
                             "provider": "parquet",
                             "options": {},
                         },
-                        "schemaString": json.dumps(
-                            {
-                                "type": "struct",
-                                "fields": [
-                                    {
-                                        "name": field.name,
-                                        "type": PA_2_DELTA_DTYPES.get(field.type.__str__(), field.type.__str__()),
-                                        "nullable": field.nullable,
-                                        "metadata": {},
-                                    }
-                                    for field in schema
-                                ],
-                            }
-                        ),
+                        "schemaString": schema_string,
                         "configuration": {},
                         "partitionColumns": [],
                     }
@@ -53,21 +64,28 @@ def generate_delta_log(output_filepath: Path, schema: Schema) -> None:
             )
         )
         # Generate "add"
-        for pp in output_filepath.glob("*.parquet"):
-            jsons.append(
-                json.dumps(
-                    {
-                        "add": {
-                            "path": pp.relative_to(output_filepath).__str__(),
-                            "partitionValues": {},
-                            "size": pp.stat().st_size,
-                            "modificationTime": int(time.time() * 1000),
-                            "dataChange": True,
+        # All the files are added by the same commit, so they share the modification time
+        modification_time = int(time.time() * 1000)
+        # DirEntry carries the file type from the directory listing, so only stat is left per file
+        with os.scandir(output_filepath) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".parquet") or not entry.is_file():
+                    continue
+                meta_log.write("\n")
+                meta_log.write(
+                    json.dumps(
+                        {
+                            "add": {
+                                "path": entry.name,
+                                "partitionValues": {},
+                                "size": entry.stat().st_size,
+                                "modificationTime": modification_time,
+                                "dataChange": True,
+                            }
                         }
-                    }
+                    )
                 )
-            )
 
         # Generate "protocol"
-        jsons.append(json.dumps({"protocol": {"minReaderVersion": 1, "minWriterVersion": 2}}))
-        meta_log.write("\n".join(jsons))
+        meta_log.write("\n")
+        meta_log.write(json.dumps({"protocol": {"minReaderVersion": 1, "minWriterVersion": 2}}))
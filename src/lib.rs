@@ -8,17 +8,223 @@ A partial inspirations for the Rust code:
 
 */
 use arrow::{
-    array::{Float64Builder, Int64Builder, RecordBatch, StringBuilder},
-    datatypes::{DataType, Field, Schema},
+    array::{
+        ArrayData, BooleanBufferBuilder, Float64Array, Float64Builder, Int64Array, Int64Builder,
+        PrimitiveArray, RecordBatch, StringArray, StringBuilder,
+    },
+    buffer::NullBuffer,
+    datatypes::{ArrowPrimitiveType, DataType, Field, Schema},
+    error::ArrowError,
     pyarrow::PyArrowType,
+    record_batch::{RecordBatchIterator, RecordBatchReader},
 };
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
 use rand::distributions::Uniform;
 use rand::seq::SliceRandom;
-use rand::{distributions::Distribution, SeedableRng};
+use rand::{distributions::Distribution, Rng, SeedableRng};
 use rand_chacha::ChaCha8Rng;
+use std::any::Any;
+use std::fmt::{self, Write};
+use std::panic;
 use std::sync::Arc;
 
+/// Format a value straight into the values buffer of the builder.
+/// Unlike `append_value(format!(..))` this does not allocate a `String` per row.
+fn append_fmt(builder: &mut StringBuilder, args: fmt::Arguments<'_>) {
+    builder
+        .write_fmt(args)
+        .expect("formatting into a StringBuilder cannot fail");
+    builder.append_value("");
+}
+
+/// Prebuilt uniform distribution of positions in a non empty slice of keys.
+/// Unlike `SliceRandom::choose`, the sampling zone is built once instead of on every call.
+/// Positions are drawn as u32 whenever the slice allows it, as `choose` does too, and as usize otherwise.
+enum KeyPositions {
+    Narrow(Uniform<u32>),
+    Wide(Uniform<usize>),
+}
+
+impl KeyPositions {
+    fn new(len: usize) -> Self {
+        match u32::try_from(len) {
+            Ok(len) => KeyPositions::Narrow(Uniform::from(0..len)),
+            Err(_) => KeyPositions::Wide(Uniform::from(0..len)),
+        }
+    }
+
+    fn sample<R: Rng>(&self, rng: &mut R) -> usize {
+        match self {
+            KeyPositions::Narrow(distr) => distr.sample(rng) as usize,
+            KeyPositions::Wide(distr) => distr.sample(rng),
+        }
+    }
+}
+
+/// Keep `keys[..x_end]` followed by `keys[l_end..r_end]` (the x and r parts of split_xlr).
+/// Works in place on the shuffled vector instead of concatenating two copied slices.
+fn keep_x_and_r(mut keys: Vec<i64>, x_end: usize, l_end: usize, r_end: usize) -> Vec<i64> {
+    assert!(
+        x_end <= l_end && r_end <= keys.len(),
+        "internal indexing error with keys"
+    );
+    keys.truncate(r_end);
+    keys.drain(x_end..l_end);
+    keys
+}
+
+/// Keep a random `amount` of `keys` in a random order, the same as a full shuffle and a truncation.
+/// Only `amount` swaps are made instead of one per key and the memory is reused in place.
+fn shuffled_prefix<R: Rng>(mut keys: Vec<i64>, amount: usize, rng: &mut R) -> Vec<i64> {
+    let rest = keys.len().saturating_sub(amount);
+    // rand 0.8 places the chosen keys at the end of the slice
+    keys.partial_shuffle(rng, amount);
+    keys.drain(..rest);
+    keys
+}
+
+/// Validity of `len` values, each of them is NULL with the `nas` percent chance.
+/// The whole bitmap is drawn at once, so the value loops have no per-row branch;
+/// there is no bitmap at all if `nas` is zero.
+fn null_mask<R: Rng>(rng: &mut R, len: usize, nas: i64) -> Option<NullBuffer> {
+    if nas <= 0 {
+        return None;
+    }
+    let distr_nas = Uniform::<i64>::from(0..=100);
+    let mut validity = BooleanBufferBuilder::new(len);
+    for _i in 0..len {
+        validity.append(distr_nas.sample(rng) >= nas);
+    }
+    Some(NullBuffer::new(validity.finish()))
+}
+
+/// Primitive column of `len` values with NULLs placed by `null_mask`.
+/// Values are drawn under NULL slots too, that is cheaper than branching on each of them.
+fn primitive_column<T, R, F>(rng: &mut R, len: usize, nas: i64, mut value: F) -> PrimitiveArray<T>
+where
+    T: ArrowPrimitiveType,
+    R: Rng,
+    F: FnMut(&mut R) -> T::Native,
+{
+    let nulls = null_mask(rng, len, nas);
+    let values: Vec<T::Native> = (0..len).map(|_| value(rng)).collect();
+    PrimitiveArray::new(values.into(), nulls)
+}
+
+/// Utf8 column of `len` values with NULLs placed by `null_mask`.
+/// Only the valid slots are formatted, `value` appends one of them to the builder.
+fn utf8_column<R, F>(
+    rng: &mut R,
+    len: usize,
+    nas: i64,
+    data_capacity: usize,
+    mut value: F,
+) -> StringArray
+where
+    R: Rng,
+    F: FnMut(&mut R, &mut StringBuilder),
+{
+    let nulls = null_mask(rng, len, nas);
+    let mut builder = StringBuilder::with_capacity(len, data_capacity);
+    for i in 0..len {
+        if nulls.as_ref().map_or(true, |nulls| nulls.is_valid(i)) {
+            value(rng, &mut builder)
+        } else {
+            builder.append_null()
+        }
+    }
+    builder.finish()
+}
+
+/// Message of a caught panic, if it has one.
+fn panic_message(payload: &(dyn Any + Send)) -> &str {
+    payload
+        .downcast_ref::<&str>()
+        .copied()
+        .or_else(|| payload.downcast_ref::<String>().map(String::as_str))
+        .unwrap_or("unknown panic")
+}
+
+fn groupby_schema() -> Schema {
+    Schema::new(vec![
+        Field::new("id1", DataType::Utf8, true),
+        Field::new("id2", DataType::Utf8, true),
+        Field::new("id3", DataType::Utf8, true),
+        Field::new("id4", DataType::Int64, true),
+        Field::new("id5", DataType::Int64, true),
+        Field::new("id6", DataType::Int64, true),
+        Field::new("v1", DataType::Int64, false),
+        Field::new("v2", DataType::Int64, false),
+        Field::new("v3", DataType::Float64, false),
+    ])
+}
+
+/// Length in bytes of the longest `id{:0width$}` value for the numbers from 1 to `max`.
+/// Values buffers are reserved by this length times the rows: they are not reallocated
+/// and a generated batch takes about its `nbytes` of memory, not a multiple of it.
+fn id_len(max: i64, width: usize) -> usize {
+    max.to_string().len().max(width) + 2
+}
+
+/// Pure Rust part of `generate_groupby`, see its docs for the parameters.
+fn groupby_batch(n: i64, k: i64, nas: i64, seed: i64, batch_size: i64) -> RecordBatch {
+    let distr_k = Uniform::<i64>::from(1..=k);
+    let distr_nk = Uniform::<i64>::from(1..=(n / k));
+    let distr_5 = Uniform::<i64>::from(1..=5);
+    let distr_15 = Uniform::<i64>::from(1..=15);
+    let distr_float = Uniform::<f64>::from(0.0..=100.0);
+    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+
+    let len = batch_size as usize; // validataion is on the python side
+
+    let id1_len = id_len(k, 3);
+    let id2_len = id_len(n / k, 3);
+    let id3_len = id_len(n / k, 10);
+
+    // Columns are generated one after another, each with its own NULLs mask
+    // id1, string in form id123, 123 from 1-K
+    let id1 = utf8_column(&mut rng, len, nas, len * id1_len, |rng, builder| {
+        append_fmt(builder, format_args!("id{:03}", distr_k.sample(rng)))
+    });
+    // id2, string in form id123, 123 from 1-K
+    let id2 = utf8_column(&mut rng, len, nas, len * id2_len, |rng, builder| {
+        append_fmt(builder, format_args!("id{:03}", distr_nk.sample(rng)))
+    });
+    // id3, string in form id1234567890, number from 1-N/K
+    let id3 = utf8_column(&mut rng, len, nas, len * id3_len, |rng, builder| {
+        append_fmt(builder, format_args!("id{:010}", distr_nk.sample(rng)))
+    });
+    // id4, 1-K, int
+    let id4: Int64Array = primitive_column(&mut rng, len, nas, |rng| distr_k.sample(rng));
+    // id5, 1-K, int
+    let id5: Int64Array = primitive_column(&mut rng, len, nas, |rng| distr_k.sample(rng));
+    // id6, 1-N/K, int
+    let id6: Int64Array = primitive_column(&mut rng, len, nas, |rng| distr_nk.sample(rng));
+    // v1, 1-5, int
+    let v1: Int64Array = primitive_column(&mut rng, len, 0, |rng| distr_5.sample(rng));
+    // v2, 1-15, int
+    let v2: Int64Array = primitive_column(&mut rng, len, 0, |rng| distr_15.sample(rng));
+    // v3, random float
+    let v3: Float64Array = primitive_column(&mut rng, len, 0, |rng| distr_float.sample(rng));
+
+    RecordBatch::try_new(
+        Arc::new(groupby_schema()),
+        vec![
+            Arc::new(id1),
+            Arc::new(id2),
+            Arc::new(id3),
+            Arc::new(id4),
+            Arc::new(id5),
+            Arc::new(id6),
+            Arc::new(v1),
+            Arc::new(v2),
+            Arc::new(v3),
+        ],
+    )
+    .unwrap()
+}
+
 /**
 Generate H2O group-by dataset.
 Running this function multiple time with the same seed
@@ -43,168 +249,162 @@ will constantly return exactly the same batch!
 */
 #[pyfunction]
 fn generate_groupby(
+    py: Python<'_>,
     n: i64,
     k: i64,
     nas: i64,
     seed: i64,
     batch_size: i64,
 ) -> PyResult<PyArrowType<RecordBatch>> {
-    let distr_k = Uniform::<i64>::try_from(1..=k)?;
-    let distr_nk = Uniform::<i64>::try_from(1..=(n / k))?;
-    let distr_5 = Uniform::<i64>::try_from(1..=5)?;
-    let distr_15 = Uniform::<i64>::try_from(1..=15)?;
-    let distr_float = Uniform::<f64>::try_from(0.0..=100.0)?;
-    let distr_nas = Uniform::<i64>::try_from(0..=100)?;
-    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+    // Generation does not touch Python objects, so the GIL is released meanwhile
+    let batch = py.allow_threads(|| groupby_batch(n, k, nas, seed, batch_size));
 
-    let item_capacity = batch_size as usize; // validataion is on the python side
+    Ok(PyArrowType(batch))
+}
 
-    let mut id1_builder = StringBuilder::with_capacity(item_capacity, item_capacity * 8 * 5); // id{:03}, utf8
-    let mut id2_builder = StringBuilder::with_capacity(item_capacity, item_capacity * 8 * 5); // id{:03}, utf8
-    let mut id3_builder = StringBuilder::with_capacity(item_capacity, item_capacity * 8 * 12); // id{:010}, utf8
-    let mut id4_builder = Int64Builder::with_capacity(item_capacity);
-    let mut id5_builder = Int64Builder::with_capacity(item_capacity);
-    let mut id6_builder = Int64Builder::with_capacity(item_capacity);
-    let mut v1_builder = Int64Builder::with_capacity(item_capacity);
-    let mut v2_builder = Int64Builder::with_capacity(item_capacity);
-    let mut v3_builder = Float64Builder::with_capacity(item_capacity);
+/**
+Generate all the batches of H2O group-by dataset with a single call.
+Batches are generated one by one while the returned reader is consumed,
+each of them is exactly the same as generate_groupby with the same seed and size.
 
-    for _i in 0..batch_size {
-        // id1, string in form id123, 123 from 1-K
-        if distr_nas.sample(&mut rng) >= nas {
-            id1_builder.append_value(format!("id{:03}", distr_k.sample(&mut rng)))
-        } else {
-            id1_builder.append_null()
-        }
-        // id2, string in form id123, 123 from 1-K
-        if distr_nas.sample(&mut rng) >= nas {
-            id2_builder.append_value(format!("id{:03}", distr_nk.sample(&mut rng)))
-        } else {
-            id2_builder.append_null()
-        }
-        // id3, string in form id1234567890, number from 1-N/K
-        if distr_nas.sample(&mut rng) >= nas {
-            id3_builder.append_value(format!("id{:010}", distr_nk.sample(&mut rng)))
-        } else {
-            id3_builder.append_null()
-        }
-        // id4, 1-K, int
-        if distr_nas.sample(&mut rng) >= nas {
-            id4_builder.append_value(distr_k.sample(&mut rng))
-        } else {
-            id4_builder.append_null()
-        }
-        // id5, 1-K, int
-        if distr_nas.sample(&mut rng) >= nas {
-            id5_builder.append_value(distr_k.sample(&mut rng))
-        } else {
-            id5_builder.append_null()
-        }
-        // id6, 1-N/K, int
-        if distr_nas.sample(&mut rng) >= nas {
-            id6_builder.append_value(distr_nk.sample(&mut rng))
-        } else {
-            id6_builder.append_null()
-        }
-        // v1, 1-5, int
-        v1_builder.append_value(distr_5.sample(&mut rng));
-        // v2, 1-15, int
-        v2_builder.append_value(distr_15.sample(&mut rng));
-        // v3, random float
-        v3_builder.append_value(distr_float.sample(&mut rng));
+:param n: int
+    A total amount of rows in dataset. Should be positive.
+    Passing a negative value or zero may tend to runtime errors / panic.
+:param k: int
+    An amount of grouping keys. Should be positive.
+    Passing a negative value or zero may tend to runtime errors / panic.
+:param nas: int
+    A number from 1 to 100 that represent a percent of NULLs.
+    Passing a value not from [0-100] may tend to unpredictable behavior.
+:param seeds: pyarrow.Int64Array
+    A random seed per batch. Should be positive!
+    Passing a negative value may tend to unpredictable behavior.
+:param batch_sizes: pyarrow.Int64Array
+    A size per batch, should have the same length as seeds.
+
+:return: pyarrow.RecordBatchReader
+*/
+#[pyfunction]
+fn generate_groupby_batches(
+    n: i64,
+    k: i64,
+    nas: i64,
+    seeds: PyArrowType<ArrayData>,
+    batch_sizes: PyArrowType<ArrayData>,
+) -> PyResult<PyArrowType<Box<dyn RecordBatchReader + Send>>> {
+    let seeds = int64_from_arrow(seeds, "seeds")?;
+    let batch_sizes = int64_from_arrow(batch_sizes, "batch sizes")?;
+    if seeds.len() != batch_sizes.len() {
+        return Err(PyValueError::new_err(format!(
+            "expected a seed per batch but got {} seeds for {} batches",
+            seeds.len(),
+            batch_sizes.len()
+        )));
     }
+    let plan: Vec<(i64, i64)> = seeds
+        .values()
+        .iter()
+        .copied()
+        .zip(batch_sizes.values().iter().copied())
+        .collect();
+    // pyarrow releases the GIL while it pulls the next batch from the stream.
+    // Batches are generated inside of the FFI get_next callback, where a panic must not unwind:
+    // it is caught and reported as an error of the stream, like pyo3 does for the per-batch calls.
+    let batches = plan.into_iter().map(move |(seed, batch_size)| {
+        panic::catch_unwind(move || groupby_batch(n, k, nas, seed, batch_size)).map_err(|payload| {
+            ArrowError::ComputeError(format!(
+                "group-by batch generation panicked: {}",
+                panic_message(payload.as_ref())
+            ))
+        })
+    });
+    let reader: Box<dyn RecordBatchReader + Send> = Box::new(RecordBatchIterator::new(
+        batches,
+        Arc::new(groupby_schema()),
+    ));
+
+    Ok(PyArrowType(reader))
+}
 
-    let schema = Schema::new(vec![
-        Field::new("id1", DataType::Utf8, true),
-        Field::new("id2", DataType::Utf8, true),
-        Field::new("id3", DataType::Utf8, true),
-        Field::new("id4", DataType::Int64, true),
-        Field::new("id5", DataType::Int64, true),
-        Field::new("id6", DataType::Int64, true),
-        Field::new("v1", DataType::Int64, false),
-        Field::new("v2", DataType::Int64, false),
-        Field::new("v3", DataType::Float64, false),
-    ]);
+fn keys_to_arrow(keys: Vec<i64>) -> PyArrowType<ArrayData> {
+    PyArrowType(ArrayData::from(Int64Array::from(keys)))
+}
 
-    let batch = RecordBatch::try_new(
-        Arc::new(schema),
-        vec![
-            Arc::new(id1_builder.finish()),
-            Arc::new(id2_builder.finish()),
-            Arc::new(id3_builder.finish()),
-            Arc::new(id4_builder.finish()),
-            Arc::new(id5_builder.finish()),
-            Arc::new(id6_builder.finish()),
-            Arc::new(v1_builder.finish()),
-            Arc::new(v2_builder.finish()),
-            Arc::new(v3_builder.finish()),
-        ],
-    ).unwrap();
+fn int64_from_arrow(data: PyArrowType<ArrayData>, what: &str) -> PyResult<Int64Array> {
+    if data.0.data_type() != &DataType::Int64 {
+        return Err(PyValueError::new_err(format!(
+            "{} should be an int64 array but got {}",
+            what,
+            data.0.data_type()
+        )));
+    }
+    if data.0.is_empty() {
+        return Err(PyValueError::new_err(format!(
+            "{} should be non empty",
+            what
+        )));
+    }
+    Ok(Int64Array::from(data.0))
+}
 
-    Ok(PyArrowType(batch))
+fn keys_from_arrow(keys: PyArrowType<ArrayData>) -> PyResult<Int64Array> {
+    int64_from_arrow(keys, "join keys")
 }
 
 /**
-Generate H2O join small dataset.
-Running this function multiple time with the same seed
-will constantly return exactly the same batch!
+Generate join-keys for the H2O join small dataset.
+Keys do not depend on the batch, so they should be generated once
+and passed to all the calls of generate_join_dataset_small.
 
 :param n: int
     A total amount of rows in dataset. Should be positive, greater than 1e6.
     Passing a negative value or zero or value less than 1e6 may tend to runtime errors / panic.
-:param seed: int
-    A seed for the current batch. Should be positive.
-    Passing a negative value may tend to unpredictable behavior.
 :keys_seed: int
-    A seed for generation of the join-keys. It should be the same for all the batches!
+    A seed for generation of the join-keys.
     Passing a negative value may tend to unpredictable behavior.
-:param batch_size: int
-    A size of the output batch.
 
-:return: pyarrow.RecordBatch
+:return: pyarrow.Int64Array
 */
 #[pyfunction]
-fn generate_join_dataset_small(
-    n: i64,
-    seed: i64,
-    keys_seed: i64,
-    batch_size: i64,
-) -> PyResult<PyArrowType<RecordBatch>> {
-    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+fn generate_join_keys_small(n: i64, keys_seed: i64) -> PyResult<PyArrowType<ArrayData>> {
     let mut keys_rng = ChaCha8Rng::seed_from_u64(keys_seed as u64);
     let mut k1: Vec<i64> = (1..=(n * 11 / 10 / 1_000_000)).collect(); // original R line: key1 = split_xlr(N/1e6)
     k1.shuffle(&mut keys_rng);
 
-    let distr_float = Uniform::<f64>::try_from(1.0..=100.0)?;
-
     // original R line (43:44)
     // x = key[seq.int(1, n*0.9)],
     // l = key[seq.int(n*0.9+1, n)],
     // r = key[seq.int(n+1, n*1.1)]
-    // we need (x, r) here
-    let mut kx = k1
-        .get(0..(n as usize * 9 / 10 / 1_000_000))
-        .expect("internal indexing error with k1")
-        .to_vec();
-    let mut kr = k1
-        .get((n as usize / 1_000_000)..(n as usize * 11 / 10 / 1_000_000))
-        .expect("internal indexing error with k1")
-        .to_vec();
-
-    kx.append(&mut kr);
+    // we need (x, r) here, so l is cut out of k1 in place
+    let kx = keep_x_and_r(
+        k1,
+        n as usize * 9 / 10 / 1_000_000,
+        n as usize / 1_000_000,
+        n as usize * 11 / 10 / 1_000_000,
+    );
+
+    Ok(keys_to_arrow(kx))
+}
+
+/// Pure Rust part of `generate_join_dataset_small`, see its docs for the parameters.
+fn join_small_batch(n: i64, kx: &[i64], seed: i64, batch_size: i64) -> RecordBatch {
+    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+
+    let distr_float = Uniform::<f64>::from(1.0..=100.0);
+    let kx_positions = KeyPositions::new(kx.len());
 
     let item_capacity = batch_size as usize; // validation is on the python side
     let len_of_max_key = (n * 11 / 10 / 1_000_000).to_string().len() + 2; // id{}, where {} is a number from a vec
 
     let mut id1_builder = Int64Builder::with_capacity(item_capacity);
     let mut id4_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_key); // utf8
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_key); // utf8
     let mut v2_builder = Float64Builder::with_capacity(item_capacity);
 
     for _i in 0..batch_size {
-        let k1 = kx.choose(&mut rng).unwrap(); // we know 100% that kx is non empty
-        id1_builder.append_value(*k1);
-        id4_builder.append_value(format!("id{}", k1));
+        let k1 = kx[kx_positions.sample(&mut rng)];
+        id1_builder.append_value(k1);
+        append_fmt(&mut id4_builder, format_args!("id{}", k1));
         v2_builder.append_value(distr_float.sample(&mut rng));
     }
 
@@ -214,7 +414,7 @@ fn generate_join_dataset_small(
         Field::new("v2", DataType::Float64, false),
     ]);
 
-    let batch = RecordBatch::try_new(
+    RecordBatch::try_new(
         Arc::new(schema),
         vec![
             Arc::new(id1_builder.finish()),
@@ -222,38 +422,61 @@ fn generate_join_dataset_small(
             Arc::new(v2_builder.finish()),
         ],
     )
-    .unwrap();
-
-    Ok(PyArrowType(batch))
+    .unwrap()
 }
 
 /**
-Generate H2O join medium dataset.
+Generate H2O join small dataset.
 Running this function multiple time with the same seed
 will constantly return exactly the same batch!
 
 :param n: int
     A total amount of rows in dataset. Should be positive, greater than 1e6.
     Passing a negative value or zero or value less than 1e6 may tend to runtime errors / panic.
+:param k1: pyarrow.Int64Array
+    Join-keys from generate_join_keys_small. It should be the same for all the batches!
 :param seed: int
     A seed for the current batch. Should be positive.
     Passing a negative value may tend to unpredictable behavior.
-:keys_seed: int
-    A seed for generation of the join-keys. It should be the same for all the batches!
-    Passing a negative value may tend to unpredictable behavior.
 :param batch_size: int
     A size of the output batch.
 
 :return: pyarrow.RecordBatch
 */
 #[pyfunction]
-fn generate_join_dataset_medium(
+fn generate_join_dataset_small(
+    py: Python<'_>,
     n: i64,
+    k1: PyArrowType<ArrayData>,
     seed: i64,
-    keys_seed: i64,
     batch_size: i64,
 ) -> PyResult<PyArrowType<RecordBatch>> {
-    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+    let k1 = keys_from_arrow(k1)?;
+    // Generation does not touch Python objects, so the GIL is released meanwhile
+    let batch = py.allow_threads(|| join_small_batch(n, k1.values(), seed, batch_size));
+
+    Ok(PyArrowType(batch))
+}
+
+/**
+Generate join-keys for the H2O join medium dataset.
+Keys do not depend on the batch, so they should be generated once
+and passed to all the calls of generate_join_dataset_medium.
+
+:param n: int
+    A total amount of rows in dataset. Should be positive, greater than 1e6.
+    Passing a negative value or zero or value less than 1e6 may tend to runtime errors / panic.
+:keys_seed: int
+    A seed for generation of the join-keys.
+    Passing a negative value may tend to unpredictable behavior.
+
+:return: tuple[pyarrow.Int64Array, pyarrow.Int64Array]
+*/
+#[pyfunction]
+fn generate_join_keys_medium(
+    n: i64,
+    keys_seed: i64,
+) -> PyResult<(PyArrowType<ArrayData>, PyArrowType<ArrayData>)> {
     let mut keys_rng = ChaCha8Rng::seed_from_u64(keys_seed as u64);
     let mut k1: Vec<i64> = (1..=(n * 11 / 10 / 1_000_000)).collect(); // original R line: key1 = split_xlr(N/1e6)
     k1.shuffle(&mut keys_rng);
@@ -261,34 +484,34 @@ fn generate_join_dataset_medium(
     let mut k2: Vec<i64> = (1..=(n * 11 / 10 / 1_000)).collect(); // original R line: key2 = split_xlr(N/1e3)
     k2.shuffle(&mut keys_rng);
 
-    let distr_float = Uniform::<f64>::try_from(1.0..=100.0)?;
-
     // orginial line (43:44)
     // x = key[seq.int(1, n*0.9)],
     // l = key[seq.int(n*0.9+1, n)],
     // Sampling both (x, l) is equal to sampling from 1..n
     // where n = n / 1e6
-    let mut k1x = k1
-        .get(0..(n as usize * 9 / 10 / 1_000_000))
-        .expect("internal indexing error with k1")
-        .to_vec();
-    let mut k1r = k1
-        .get((n as usize / 1_000_000)..(n as usize * 11 / 10 / 1_000_000))
-        .expect("internal indexing error with k1")
-        .to_vec();
-
-    k1x.append(&mut k1r);
-
-    let mut k2x = k2
-        .get(0..(n as usize * 9 / 10 / 1_000_000))
-        .expect("internal indexing error with k2")
-        .to_vec();
-    let mut k2r = k2
-        .get((n as usize / 1_000_000)..(n as usize * 11 / 10 / 1_000_000))
-        .expect("internal indexing error with k2")
-        .to_vec();
-
-    k2x.append(&mut k2r);
+    let k1x = keep_x_and_r(
+        k1,
+        n as usize * 9 / 10 / 1_000_000,
+        n as usize / 1_000_000,
+        n as usize * 11 / 10 / 1_000_000,
+    );
+    let k2x = keep_x_and_r(
+        k2,
+        n as usize * 9 / 10 / 1_000_000,
+        n as usize / 1_000_000,
+        n as usize * 11 / 10 / 1_000_000,
+    );
+
+    Ok((keys_to_arrow(k1x), keys_to_arrow(k2x)))
+}
+
+/// Pure Rust part of `generate_join_dataset_medium`, see its docs for the parameters.
+fn join_medium_batch(n: i64, k1x: &[i64], k2x: &[i64], seed: i64, batch_size: i64) -> RecordBatch {
+    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+
+    let distr_float = Uniform::<f64>::from(1.0..=100.0);
+    let k1x_positions = KeyPositions::new(k1x.len());
+    let k2x_positions = KeyPositions::new(k2x.len());
 
     let item_capacity = batch_size as usize;
     let len_of_max_k1_key = (n * 11 / 10 / 1_000_000).to_string().len() + 2; // id{}, where {} is a number from a vec
@@ -297,19 +520,19 @@ fn generate_join_dataset_medium(
     let mut id1_builder = Int64Builder::with_capacity(item_capacity);
     let mut id2_builder = Int64Builder::with_capacity(item_capacity);
     let mut id4_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_k1_key); // utf8
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_k1_key); // utf8
     let mut id5_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_k2_key); // utf8
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_k2_key); // utf8
     let mut v2_builder = Float64Builder::with_capacity(item_capacity);
 
     for _i in 0..batch_size {
-        let k1 = k1x.choose(&mut rng).unwrap(); // we know 100% that k1x is non empty
-        let k2 = k2x.choose(&mut rng).unwrap(); // we know 100% that k2x is non empty
+        let k1 = k1x[k1x_positions.sample(&mut rng)];
+        let k2 = k2x[k2x_positions.sample(&mut rng)];
 
-        id1_builder.append_value(*k1);
-        id2_builder.append_value(*k2);
-        id4_builder.append_value(format!("id{}", k1));
-        id5_builder.append_value(format!("id{}", k2));
+        id1_builder.append_value(k1);
+        id2_builder.append_value(k2);
+        append_fmt(&mut id4_builder, format_args!("id{}", k1));
+        append_fmt(&mut id5_builder, format_args!("id{}", k2));
         v2_builder.append_value(distr_float.sample(&mut rng));
     }
 
@@ -321,7 +544,7 @@ fn generate_join_dataset_medium(
         Field::new("v2", DataType::Float64, false),
     ]);
 
-    let batch = RecordBatch::try_new(
+    RecordBatch::try_new(
         Arc::new(schema),
         vec![
             Arc::new(id1_builder.finish()),
@@ -331,123 +554,142 @@ fn generate_join_dataset_medium(
             Arc::new(v2_builder.finish()),
         ],
     )
-    .unwrap();
-
-    Ok(PyArrowType(batch))
+    .unwrap()
 }
 
 /**
-Generate H2O join big dataset.
+Generate H2O join medium dataset.
 Running this function multiple time with the same seed
 will constantly return exactly the same batch!
 
 :param n: int
     A total amount of rows in dataset. Should be positive, greater than 1e6.
-    Passing a negative value or zero or a value less than 1e6 may tend to runtime errors / panic.
-:param nas: int
-    A number from 1 to 100 that represent a percent of NULLs.
-    Passing a value not from [0-100] may tend to unpredictable behavior.
+    Passing a negative value or zero or value less than 1e6 may tend to runtime errors / panic.
+:param k1: pyarrow.Int64Array
+    The first join-keys from generate_join_keys_medium. It should be the same for all the batches!
+:param k2: pyarrow.Int64Array
+    The second join-keys from generate_join_keys_medium. It should be the same for all the batches!
 :param seed: int
     A seed for the current batch. Should be positive.
     Passing a negative value may tend to unpredictable behavior.
-:keys_seed: int
-    A seed for generation of the join-keys. It should be the same for all the batches!
-    Passing a negative value may tend to unpredictable behavior.
 :param batch_size: int
     A size of the output batch.
 
 :return: pyarrow.RecordBatch
- */
+*/
 #[pyfunction]
-fn generate_join_dataset_big(
+fn generate_join_dataset_medium(
+    py: Python<'_>,
     n: i64,
-    nas: i64,
+    k1: PyArrowType<ArrayData>,
+    k2: PyArrowType<ArrayData>,
     seed: i64,
-    keys_seed: i64,
     batch_size: i64,
 ) -> PyResult<PyArrowType<RecordBatch>> {
-    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
-    let mut keys_rng = ChaCha8Rng::seed_from_u64(keys_seed as u64);
-    let mut k1: Vec<i64> = (1..=(n * 11 / 10 / 1_000_000)).collect(); // original R line: key1 = split_xlr(N/1e6)
-    k1.shuffle(&mut keys_rng);
+    let k1 = keys_from_arrow(k1)?;
+    let k2 = keys_from_arrow(k2)?;
+    // Generation does not touch Python objects, so the GIL is released meanwhile
+    let batch =
+        py.allow_threads(|| join_medium_batch(n, k1.values(), k2.values(), seed, batch_size));
 
-    let mut k2: Vec<i64> = (1..=(n * 11 / 10 / 1_000)).collect(); // original R line: key2 = split_xlr(N/1e3)
-    k2.shuffle(&mut keys_rng);
+    Ok(PyArrowType(batch))
+}
+
+/**
+Generate join-keys for the H2O join big dataset.
+Keys do not depend on the batch, so they should be generated once
+and passed to all the calls of generate_join_dataset_big.
 
-    let mut k3: Vec<i64> = (1..=(n * 11 / 10)).collect(); // original R line: key3 = split_xlr(N)
-    k3.shuffle(&mut keys_rng);
+:param n: int
+    A total amount of rows in dataset. Should be positive, greater than 1e6.
+    Passing a negative value or zero or a value less than 1e6 may tend to runtime errors / panic.
+:keys_seed: int
+    A seed for generation of the join-keys.
+    Passing a negative value may tend to unpredictable behavior.
 
-    let distr_float = Uniform::<f64>::try_from(1.0..=100.0)?;
-    let distr_nas = Uniform::<i64>::try_from(0..=100)?;
+:return: tuple[pyarrow.Int64Array, pyarrow.Int64Array, pyarrow.Int64Array]
+ */
+#[pyfunction]
+fn generate_join_keys_big(
+    n: i64,
+    keys_seed: i64,
+) -> PyResult<(
+    PyArrowType<ArrayData>,
+    PyArrowType<ArrayData>,
+    PyArrowType<ArrayData>,
+)> {
+    let mut keys_rng = ChaCha8Rng::seed_from_u64(keys_seed as u64);
+    let k1: Vec<i64> = (1..=(n * 11 / 10 / 1_000_000)).collect(); // original R line: key1 = split_xlr(N/1e6)
+    let k2: Vec<i64> = (1..=(n * 11 / 10 / 1_000)).collect(); // original R line: key2 = split_xlr(N/1e3)
+    let k3: Vec<i64> = (1..=(n * 11 / 10)).collect(); // original R line: key3 = split_xlr(N)
 
     // orginial line (43:44)
     // x = key[seq.int(1, n*0.9)],
     // l = key[seq.int(n*0.9+1, n)],
     // Sampling both (x, l) is equal to sampling from 1..n
     // where n = n / 1e6
-    k1 = k1
-        .get(0..(n as usize / 1_000_000))
-        .expect("internal indexing error with k1")
-        .to_vec();
+    // Only the kept part is shuffled, in place: copying a prefix of k3 would double the peak memory for BIG.
+    let k1 = shuffled_prefix(k1, n as usize / 1_000_000, &mut keys_rng);
 
     // same logic here
     // see https://github.com/h2oai/db-benchmark/blob/master/_data/join-datagen.R#L40
     // for details
-    k2 = k2
-        .get(0..(n as usize / 1_000))
-        .expect("internal indexing error with k2")
-        .to_vec();
-    k3 = k3
-        .get(0..(n as usize))
-        .expect("internal indexing error with k3")
-        .to_vec();
+    let k2 = shuffled_prefix(k2, n as usize / 1_000, &mut keys_rng);
+    let k3 = shuffled_prefix(k3, n as usize, &mut keys_rng);
+
+    Ok((keys_to_arrow(k1), keys_to_arrow(k2), keys_to_arrow(k3)))
+}
+
+/// Pure Rust part of `generate_join_dataset_big`, see its docs for the parameters.
+fn join_big_batch(
+    n: i64,
+    nas: i64,
+    k1: &[i64],
+    k2: &[i64],
+    k3: &[i64],
+    seed: i64,
+    batch_size: i64,
+) -> RecordBatch {
+    let mut rng = ChaCha8Rng::seed_from_u64(seed as u64);
+
+    let distr_float = Uniform::<f64>::from(1.0..=100.0);
+    let k1_positions = KeyPositions::new(k1.len());
+    let k2_positions = KeyPositions::new(k2.len());
+    let k3_positions = KeyPositions::new(k3.len());
 
     let item_capacity = batch_size as usize;
     let len_of_max_k1_key = (n * 11 / 10 / 1_000_000).to_string().len() + 2; // id{}, where {} is a number from a vec
     let len_of_max_k2_key = (n * 11 / 10 / 1_000).to_string().len() + 2; // the same
     let len_of_max_k3_key = (n * 11 / 10).to_string().len() + 2; // the same
 
-    let mut id1_builder = Int64Builder::with_capacity(item_capacity);
-    let mut id2_builder = Int64Builder::with_capacity(item_capacity);
-    let mut id3_builder = Int64Builder::with_capacity(item_capacity);
     let mut id4_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_k1_key); // utf8
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_k1_key); // utf8
     let mut id5_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_k2_key); // utf8
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_k2_key); // utf8
     let mut id6_builder =
-        StringBuilder::with_capacity(item_capacity, item_capacity * 8 * len_of_max_k3_key); // utf8
-    let mut v2_builder = Float64Builder::with_capacity(item_capacity);
+        StringBuilder::with_capacity(item_capacity, item_capacity * len_of_max_k3_key); // utf8
 
+    let mut k1_values = Vec::with_capacity(item_capacity);
+    let mut k2_values = Vec::with_capacity(item_capacity);
+    let mut k3_values = Vec::with_capacity(item_capacity);
     for _i in 0..batch_size {
-        // We exactly know at the moment that k1, k2, k3 are non empty
-        let k1 = k1.choose(&mut rng).unwrap();
-        let k2 = k2.choose(&mut rng).unwrap();
-        let k3 = k3.choose(&mut rng).unwrap();
-
-        if distr_nas.sample(&mut rng) >= nas {
-            id1_builder.append_value(*k1)
-        } else {
-            id1_builder.append_null()
-        }
-        if distr_nas.sample(&mut rng) >= nas {
-            id2_builder.append_value(*k2)
-        } else {
-            id2_builder.append_null()
-        }
-        if distr_nas.sample(&mut rng) >= nas {
-            id3_builder.append_value(*k3)
-        } else {
-            id3_builder.append_null()
-        }
-        id4_builder.append_value(format!("id{}", k1));
-        id5_builder.append_value(format!("id{}", k2));
-        id6_builder.append_value(format!("id{}", k2));
-        if distr_nas.sample(&mut rng) >= nas {
-            v2_builder.append_value(distr_float.sample(&mut rng));
-        } else {
-            v2_builder.append_null()
-        }
+        let k1 = k1[k1_positions.sample(&mut rng)];
+        let k2 = k2[k2_positions.sample(&mut rng)];
+        let k3 = k3[k3_positions.sample(&mut rng)];
+
+        append_fmt(&mut id4_builder, format_args!("id{}", k1));
+        append_fmt(&mut id5_builder, format_args!("id{}", k2));
+        append_fmt(&mut id6_builder, format_args!("id{}", k2));
+        k1_values.push(k1);
+        k2_values.push(k2);
+        k3_values.push(k3);
     }
+    // NULLs are placed only into the int columns, string ones keep all the keys
+    let id1 = Int64Array::new(k1_values.into(), null_mask(&mut rng, item_capacity, nas));
+    let id2 = Int64Array::new(k2_values.into(), null_mask(&mut rng, item_capacity, nas));
+    let id3 = Int64Array::new(k3_values.into(), null_mask(&mut rng, item_capacity, nas));
+    let v2: Float64Array =
+        primitive_column(&mut rng, item_capacity, nas, |rng| distr_float.sample(rng));
 
     let schema = Schema::new(vec![
         Field::new("id1", DataType::Int64, true),
@@ -459,19 +701,72 @@ fn generate_join_dataset_big(
         Field::new("v2", DataType::Float64, true),
     ]);
 
-    let batch = RecordBatch::try_new(
+    RecordBatch::try_new(
         Arc::new(schema),
         vec![
-            Arc::new(id1_builder.finish()),
-            Arc::new(id2_builder.finish()),
-            Arc::new(id3_builder.finish()),
+            Arc::new(id1),
+            Arc::new(id2),
+            Arc::new(id3),
             Arc::new(id4_builder.finish()),
             Arc::new(id5_builder.finish()),
             Arc::new(id6_builder.finish()),
-            Arc::new(v2_builder.finish()),
+            Arc::new(v2),
         ],
     )
-    .unwrap();
+    .unwrap()
+}
+
+/**
+Generate H2O join big dataset.
+Running this function multiple time with the same seed
+will constantly return exactly the same batch!
+
+:param n: int
+    A total amount of rows in dataset. Should be positive, greater than 1e6.
+    Passing a negative value or zero or a value less than 1e6 may tend to runtime errors / panic.
+:param nas: int
+    A number from 1 to 100 that represent a percent of NULLs.
+    Passing a value not from [0-100] may tend to unpredictable behavior.
+:param k1: pyarrow.Int64Array
+    The first join-keys from generate_join_keys_big. It should be the same for all the batches!
+:param k2: pyarrow.Int64Array
+    The second join-keys from generate_join_keys_big. It should be the same for all the batches!
+:param k3: pyarrow.Int64Array
+    The third join-keys from generate_join_keys_big. It should be the same for all the batches!
+:param seed: int
+    A seed for the current batch. Should be positive.
+    Passing a negative value may tend to unpredictable behavior.
+:param batch_size: int
+    A size of the output batch.
+
+:return: pyarrow.RecordBatch
+ */
+#[pyfunction]
+fn generate_join_dataset_big(
+    py: Python<'_>,
+    n: i64,
+    nas: i64,
+    k1: PyArrowType<ArrayData>,
+    k2: PyArrowType<ArrayData>,
+    k3: PyArrowType<ArrayData>,
+    seed: i64,
+    batch_size: i64,
+) -> PyResult<PyArrowType<RecordBatch>> {
+    let k1 = keys_from_arrow(k1)?;
+    let k2 = keys_from_arrow(k2)?;
+    let k3 = keys_from_arrow(k3)?;
+    // Generation does not touch Python objects, so the GIL is released meanwhile
+    let batch = py.allow_threads(|| {
+        join_big_batch(
+            n,
+            nas,
+            k1.values(),
+            k2.values(),
+            k3.values(),
+            seed,
+            batch_size,
+        )
+    });
 
     Ok(PyArrowType(batch))
 }
@@ -479,8 +774,12 @@ fn generate_join_dataset_big(
 #[pymodule]
 fn native(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(generate_groupby, m)?)?;
+    m.add_function(wrap_pyfunction!(generate_groupby_batches, m)?)?;
+    m.add_function(wrap_pyfunction!(generate_join_keys_small, m)?)?;
     m.add_function(wrap_pyfunction!(generate_join_dataset_small, m)?)?;
+    m.add_function(wrap_pyfunction!(generate_join_keys_medium, m)?)?;
     m.add_function(wrap_pyfunction!(generate_join_dataset_medium, m)?)?;
+    m.add_function(wrap_pyfunction!(generate_join_keys_big, m)?)?;
     m.add_function(wrap_pyfunction!(generate_join_dataset_big, m)?)?;
     Ok(())
 }